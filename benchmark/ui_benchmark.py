@@ -0,0 +1,372 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Headless UI performance harness for WelcomeWindow.
+#
+# Runs the app against a broadway daemon (or whatever display GDK_BACKEND
+# already points at), with lrun and webbrowser.open stubbed out and device and
+# package state taken from the fixture sysroot next to this file. It drives
+# the welcome button, carousel and page buttons, records time to first frame,
+# page build times, carousel latencies up to the next frame and page button
+# handler times from the metrics registry, and compares them with a
+# stored baseline. Timings only compare on the machine that recorded them, so
+# no baseline is shipped: record one with --update-baseline on the machine that
+# runs the harness. Exits with 1 if anything got slower than the baseline
+# allows, and with 2 if there is no baseline to compare with.
+
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from time import monotonic, sleep
+from statistics import median
+
+benchmark_path: str = os.path.dirname(os.path.realpath(__file__))
+repo_path: str = os.path.dirname(benchmark_path)
+sysroot_path: str = os.path.join(benchmark_path, "sysroot")
+
+# A result fails when it exceeds baseline * (1 + TOLERANCE) + slack. Results
+# measured up to a frame or signal also depend on where the frame clock was
+# when the action ran, so they get one display interval of slack.
+TOLERANCE = 0.5
+SLACK_MS = 5.0
+FRAME_SLACK_MS = 1000 / 60
+FRAME_TIMED = (
+    "time_to_first_frame",
+    "welcome_button",
+    "next_button",
+    "previous_button.settled",
+)
+# Carousel buttons are debounced by 0.5s
+DEBOUNCE_SECONDS = 0.6
+
+
+def start_broadway(runtime_dir: str, display: int) -> subprocess.Popen:
+    """
+    Start a broadway daemon and point GDK at it
+
+        :param runtime_dir:  XDG_RUNTIME_DIR for the daemon and the app
+        :type runtime_dir: str
+        :param display:  The broadway display number
+        :type display: int
+        :return:  The daemon process
+    """
+    broadwayd = shutil.which("gtk4-broadwayd") or shutil.which("broadwayd")
+    if broadwayd is None:
+        sys.exit("gtk4-broadwayd not found, install libgtk-4-bin")
+    daemon = subprocess.Popen(
+        [broadwayd, f":{display}"],
+        env=dict(os.environ, XDG_RUNTIME_DIR=runtime_dir),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = monotonic() + 10
+    while not glob.glob(os.path.join(runtime_dir, "broadway*.socket")):
+        if monotonic() > deadline or daemon.poll() is not None:
+            sys.exit("gtk4-broadwayd did not start")
+        sleep(0.05)
+    os.environ["GDK_BACKEND"] = "broadway"
+    os.environ["BROADWAY_DISPLAY"] = f":{display}"
+    return daemon
+
+
+def read_fixture_compatible() -> list:
+    compatible = os.path.join(sysroot_path, "proc", "device-tree", "compatible")
+    with open(compatible, "rb") as f:
+        return [entry.decode("ascii") for entry in f.read().split(b"\x00") if entry]
+
+
+def read_fixture_installed() -> set:
+    """Return the installed packages of the fixture dpkg status file."""
+    installed = set()
+    with open(os.path.join(sysroot_path, "var", "lib", "dpkg", "status"), "r") as f:
+        for stanza in f.read().split("\n\n"):
+            fields = dict(
+                line.split(": ", 1) for line in stanza.splitlines() if ": " in line
+            )
+            if fields.get("Status") == "install ok installed":
+                installed.add(fields["Package"])
+    return installed
+
+
+def install_stubs(welcome, welcome_support, welcome_devices, calls: list) -> None:
+    """Replace everything that reaches outside the process with fixtures."""
+    compatible = read_fixture_compatible()
+    installed = read_fixture_installed()
+
+    def lrun(cmd, wait=True, log_output=True):
+        calls.append(cmd)
+
+    def open_url(url, new=0):
+        calls.append(["webbrowser.open", url])
+        return True
+
+    def is_prefetch_enabled(callback):
+        callback(False)
+
+    welcome_support.lrun = lrun
+    welcome_support.check_app_installed = lambda app_pkg: app_pkg in installed
+    welcome_support.read_catalog_cache = lambda: None
+    welcome.is_prefetch_enabled = is_prefetch_enabled
+    welcome_devices.detect_compatible = lambda: compatible
+    welcome_devices.get_device_profile.cache_clear()
+    welcome.open = open_url
+
+
+class Driver:
+    """Drives the main loop until frames are drawn or signals fire"""
+
+    def __init__(self, GLib) -> None:
+        self.GLib = GLib
+        self.context = GLib.MainContext.default()
+
+    def run_until(self, predicate, timeout: float = 10.0) -> None:
+        # Wakes the blocking iteration up regularly to re-check the predicate
+        wakeup = self.GLib.timeout_add(20, lambda: True)
+        deadline = monotonic() + timeout
+        try:
+            while not predicate():
+                if monotonic() > deadline:
+                    raise TimeoutError("UI did not respond in time")
+                self.context.iteration(True)
+        finally:
+            self.GLib.source_remove(wakeup)
+
+    def settle(self, seconds: float) -> None:
+        deadline = monotonic() + seconds
+        self.run_until(lambda: monotonic() >= deadline, timeout=seconds + 1)
+
+    def time_to_frame(self, widget, action) -> float:
+        """Run action and return the milliseconds until the next frame."""
+        frames = []
+
+        def on_tick(widget, frame_clock) -> bool:
+            frames.append(monotonic())
+            return self.GLib.SOURCE_CONTINUE
+
+        tick = widget.add_tick_callback(on_tick)
+        start = monotonic()
+        action()
+        try:
+            self.run_until(lambda: frames)
+        finally:
+            widget.remove_tick_callback(tick)
+        return (frames[0] - start) * 1000
+
+    def time_to_signal(self, obj, signal: str, action) -> float:
+        """Run action and return the milliseconds until obj emits signal."""
+        fired = []
+        handler = obj.connect(signal, lambda *_: fired.append(monotonic()))
+        start = monotonic()
+        action()
+        try:
+            self.run_until(lambda: fired)
+        finally:
+            obj.disconnect(handler)
+        return (fired[0] - start) * 1000
+
+
+def close_dialogs(Gtk, window) -> None:
+    for toplevel in Gtk.Window.list_toplevels():
+        if toplevel is not window and toplevel.get_visible():
+            toplevel.close()
+
+
+def run_scenario(repeat: int) -> dict:
+    """
+    Build the window and drive it
+
+        :param repeat:  How often to repeat every interaction
+        :type repeat: int
+        :return:  {measurement: milliseconds}
+        :rtype: dict
+    """
+    sys.path.insert(0, repo_path)
+    import launch
+
+    launch.set_schemas()
+    launch.set_resources()
+
+    import welcome
+    import welcome_support
+    import welcome_devices
+    from welcome_metrics import metrics
+    from gi.repository import Gtk, Gio, GLib  # type: ignore
+
+    calls: list = []
+    install_stubs(welcome, welcome_support, welcome_devices, calls)
+    driver = Driver(GLib)
+    results: dict = {}
+    samples: dict = {}
+
+    def sample(name: str, ms: float) -> None:
+        samples.setdefault(name, []).append(ms)
+
+    app = welcome.WelcomeApp(
+        application_id="com.radxa.welcome.Benchmark",
+        flags=Gio.ApplicationFlags.NON_UNIQUE,
+    )
+    app.register(None)
+
+    start = monotonic()
+    app.activate()
+    window = app.win
+    activate_ms = (monotonic() - start) * 1000
+    results["time_to_first_frame"] = activate_ms + driver.time_to_frame(
+        window, lambda: None
+    )
+    for name in ("startup.window", "startup.links_page", "startup.apps_page"):
+        histogram = metrics.histograms[name]
+        results[name] = histogram.total_ms / histogram.count
+
+    # Welcome page to content page
+    sample(
+        "welcome_button",
+        driver.time_to_frame(window, lambda: window.welcome_button.emit("clicked")),
+    )
+
+    for _ in range(repeat):
+        driver.settle(DEBOUNCE_SECONDS)
+        sample(
+            "next_button",
+            driver.time_to_frame(window, lambda: window.next_button.emit("clicked")),
+        )
+        driver.run_until(lambda: int(window.carousel.get_position()) == 1)
+        driver.settle(DEBOUNCE_SECONDS)
+        sample(
+            "previous_button.settled",
+            driver.time_to_signal(
+                window.carousel,
+                "page-changed",
+                lambda: window.previous_button.emit("clicked"),
+            ),
+        )
+
+    # Page button handlers time themselves into the metrics registry
+    buttons = {
+        "links.docs": window.links_page.docs_button,
+        "links.website": window.links_page.website_button,
+        "apps.terminal": window.apps_page.terminal_button,
+        "apps.software": window.apps_page.software_button,
+    }
+    for _ in range(repeat):
+        for button in buttons.values():
+            button.emit("clicked")
+            driver.settle(0.05)
+            close_dialogs(Gtk, window)
+
+    for name, values in samples.items():
+        results[name] = median(values)
+    for name in buttons:
+        histogram = metrics.histograms[name]
+        results[name] = histogram.total_ms / histogram.count
+
+    if not any(cmd[0] == "webbrowser.open" for cmd in calls):
+        raise AssertionError("links page buttons did not open any URL")
+    if not any(cmd[:2] == ["gtk-launch", "org.gnome.Terminal"] for cmd in calls):
+        raise AssertionError("terminal button did not launch the installed terminal")
+
+    window.destroy()
+    app.quit()
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Return a description of every result slower than its baseline allows."""
+    regressions = []
+    for name, ms in sorted(results.items()):
+        if name not in baseline:
+            continue
+        slack = FRAME_SLACK_MS if name in FRAME_TIMED else SLACK_MS
+        limit = baseline[name] * (1 + TOLERANCE) + slack
+        if ms > limit:
+            regressions.append(
+                f"{name}: {ms:.1f}ms > {limit:.1f}ms (baseline {baseline[name]:.1f}ms)"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Headless UI performance harness for WelcomeWindow."
+    )
+    parser.add_argument(
+        "--baseline",
+        default=os.path.join(benchmark_path, "baseline.json"),
+        help="baseline to compare with or update",
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="store the results as baseline"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions")
+    parser.add_argument("--display", type=int, default=7, help="broadway display")
+    args = parser.parse_args()
+
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline}, record one on this machine with "
+            "--update-baseline or pass --baseline"
+        )
+        return 2
+
+    # Nothing may touch the real home directory, dconf or renderer cache
+    home = tempfile.mkdtemp(prefix="radxa-welcome-benchmark-")
+    runtime_dir = os.path.join(home, "runtime")
+    os.mkdir(runtime_dir, 0o700)
+    os.environ.update(
+        HOME=home,
+        XDG_RUNTIME_DIR=runtime_dir,
+        GSETTINGS_BACKEND="memory",
+        GSK_RENDERER=os.environ.get("GSK_RENDERER", "cairo"),
+        LANG="C.UTF-8",
+    )
+    daemon = None
+    if "GDK_BACKEND" not in os.environ:
+        daemon = start_broadway(runtime_dir, args.display)
+    try:
+        results = run_scenario(args.repeat)
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        shutil.rmtree(home, ignore_errors=True)
+
+    for name, ms in sorted(results.items()):
+        print(f"{name}: {ms:.1f}ms")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as baseline_file:
+        regressions = compare(results, json.load(baseline_file))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,8 +22,10 @@ import faulthandler
 faulthandler.enable()
 
 from sys import argv
-from os import path
+from os import path, environ
 
+from welcome_metrics import metrics, dump_metrics
+from welcome_renderer import select_renderer, run_benchmark
 from gi.repository import Gio
 
 script_path: str = path.dirname(path.realpath(__file__))
@@ -51,9 +53,34 @@ def set_resources() -> None:
     Gio.Resource._register(resource)
 
 
+def set_schemas() -> None:
+    """Compiles and uses the settings schema when running from source."""
+    from subprocess import run
+
+    data_path: str = path.join(script_path, "data")
+    # installed copies get their schema from glib-2.0/schemas instead
+    if not path.exists(path.join(data_path, "com.radxa.welcome.gschema.xml")):
+        return
+    run(["glib-compile-schemas", data_path])
+    environ["GSETTINGS_SCHEMA_DIR"] = data_path
+
+
 if __name__ == "__main__":
-    set_resources()
-    import welcome
+    if "--metrics" in argv:
+        dump_metrics()
+        exit(0)
+    if "--benchmark-renderer" in argv:
+        run_benchmark(argv[argv.index("--benchmark-renderer") + 1])
+        exit(0)
+    # Must happen before anything imports Gtk
+    with metrics.timed("startup.renderer"):
+        select_renderer(path.realpath(__file__))
+    with metrics.timed("startup.schemas"):
+        set_schemas()
+    with metrics.timed("startup.resources"):
+        set_resources()
+    with metrics.timed("startup.import"):
+        import welcome
 
     app = welcome.WelcomeApp(application_id="com.radxa.welcome")
     app.run(argv)
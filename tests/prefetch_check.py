@@ -0,0 +1,169 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Runs welcome_prefetch.prefetch() against a throwaway local apt repository.
+#
+# The repository is a copy: source, because apt uses file: repositories in
+# place and never copies their packages into the archive cache. apt state,
+# cache and sources all live in a temporary directory, so the system apt
+# configuration is neither used nor touched. Checks that the size and free
+# space limits skip the download, and that a download within the limits ends
+# up in --archives. Exits with 1 on failure.
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+repo_path: str = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+PACKAGES = ("radxa-welcome-prefetch-check-a", "radxa-welcome-prefetch-check-b")
+
+
+def build_repository(root: str) -> str:
+    """
+    Build a flat apt repository with one dummy package per PACKAGES entry
+
+        :param root:  The temporary directory to build in
+        :type root: str
+        :return:  The repository directory
+        :rtype: str
+    """
+    repository = os.path.join(root, "repo")
+    os.makedirs(repository)
+    stanzas = []
+    for package in PACKAGES:
+        source = os.path.join(root, "build", package)
+        os.makedirs(os.path.join(source, "DEBIAN"))
+        doc_path = os.path.join(source, "usr", "share", "doc", package)
+        os.makedirs(doc_path)
+        with open(os.path.join(doc_path, "README"), "w") as f:
+            f.write(f"{package}\n" * 256)
+        with open(os.path.join(source, "DEBIAN", "control"), "w") as f:
+            f.write(
+                f"Package: {package}\n"
+                "Version: 1.0\n"
+                "Architecture: all\n"
+                "Maintainer: Radxa <dev@radxa.com>\n"
+                "Description: Radxa Welcome prefetch check\n"
+            )
+        deb_name = f"{package}_1.0_all.deb"
+        subprocess.run(
+            ["dpkg-deb", "--build", source, os.path.join(repository, deb_name)],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        with open(os.path.join(repository, deb_name), "rb") as deb:
+            data = deb.read()
+        with open(os.path.join(source, "DEBIAN", "control"), "r") as f:
+            control = f.read()
+        stanzas.append(
+            control
+            + f"Filename: ./{deb_name}\n"
+            + f"Size: {len(data)}\n"
+            + f"SHA256: {hashlib.sha256(data).hexdigest()}\n"
+        )
+    with open(os.path.join(repository, "Packages"), "w") as f:
+        f.write("\n".join(stanzas))
+    return repository
+
+
+def get_apt_options(root: str, repository: str) -> list:
+    """Return the apt options that confine apt to root and repository."""
+    for directory in ("sources.list.d", "lists/partial", "cache"):
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+    with open(os.path.join(root, "sources.list"), "w") as f:
+        f.write(f"deb [trusted=yes] copy:{repository} ./\n")
+    # An empty dpkg status, so nothing counts as installed already
+    open(os.path.join(root, "status"), "w").close()
+    return [
+        f"Dir::Etc::SourceList={os.path.join(root, 'sources.list')}",
+        f"Dir::Etc::SourceParts={os.path.join(root, 'sources.list.d')}",
+        f"Dir::State::Lists={os.path.join(root, 'lists')}",
+        f"Dir::State::status={os.path.join(root, 'status')}",
+        f"Dir::Cache={os.path.join(root, 'cache')}",
+        "APT::Sandbox::User=root",
+        "Debug::NoLocking=1",
+    ]
+
+
+def get_debs(archives: str) -> list:
+    return sorted(name for name in os.listdir(archives) if name.endswith(".deb"))
+
+
+def main() -> int:
+    for tool in ("apt-get", "dpkg-deb"):
+        if shutil.which(tool) is None:
+            print(f"SKIP {tool} not found")
+            return 0
+
+    sys.path.insert(0, repo_path)
+    import welcome_prefetch
+
+    # Which categories lack an app depends on the host, so use the dummies
+    welcome_prefetch.get_prefetch_candidates = lambda: list(PACKAGES)
+
+    root = tempfile.mkdtemp(prefix="radxa-welcome-prefetch-")
+    failures = []
+    try:
+        repository = build_repository(root)
+        apt_options = get_apt_options(root, repository)
+        update = ["apt-get", "update", "-q"]
+        for option in apt_options:
+            update += ["-o", option]
+        subprocess.run(update, stdout=subprocess.DEVNULL, check=True)
+
+        archives = os.path.join(root, "archives")
+        base_args = ["--force", "--archives", archives]
+        for option in apt_options:
+            base_args += ["--apt-option", option]
+
+        def run(name: str, extra_args: list, expected_debs: list) -> None:
+            args = welcome_prefetch.parse_args(base_args + extra_args)
+            returncode = welcome_prefetch.prefetch(args)
+            debs = get_debs(archives)
+            if returncode != 0 or debs != expected_debs:
+                failures.append(f"{name}: exit code {returncode}, archives {debs}")
+                print(f"FAIL {name}")
+            else:
+                print(f"PASS {name}")
+
+        expected = [f"{package}_1.0_all.deb" for package in PACKAGES]
+        run("download over --max-download is skipped", ["--max-download", "0"], [])
+        free_mib = shutil.disk_usage(root).free // (1024 * 1024)
+        run(
+            "download under --min-free is skipped",
+            ["--min-free", str(free_mib + 1)],
+            [],
+        )
+        run("--dry-run downloads nothing", ["--dry-run"], [])
+        run("download within the limits reaches --archives", [], expected)
+        run("cached packages are not downloaded again", [], expected)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,16 +26,22 @@ from welcome_support import (
     app_settings,
     apps,
     lp,
-    change_autolaunch,
-    lrun,
+    change_prefetch,
+    is_prefetch_enabled,
     debounce,
     add_custom_styling,
     load_css,
     settings_get,
     settings_set,
+    update_autostart_entry,
     check_installed,
+    launch_app,
     get_info_for_welcome,
 )
+from welcome_diagnostics import export_diagnostic_bundle, get_default_bundle_name
+from welcome_devices import get_device_profile
+from welcome_metrics import metrics
+from welcome_renderer import is_reduced_motion
 from locale import getlocale
 from webbrowser import open
 from os import path
@@ -51,28 +57,49 @@ class WelcomeApp(Adw.Application):
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
         self.connect("activate", self.on_activate)
+        self.connect("shutdown", self.on_shutdown)
         global css_provider
         css_provider = load_css(path.dirname(__file__) + "/data/ui/main.css")
 
     def on_activate(self, app) -> None:
         self.create_action("about", self.on_about_action)
         self.create_action("preferences", self.on_preferences_action)
+        self.create_action("export_diagnostics", self.on_export_diagnostics_action)
 
     def do_activate(self) -> None:
         """Callback for the app.activate signal."""
 
         global win
-        win = self.props.active_window
-        if not win:
-            win = WelcomeWindow(application=self)
-            self.win = win
-        win.present()
-
+        metrics.since_start("startup.activate")
+        if is_reduced_motion():
+            lp("Slow rendering detected, reducing animations.", mode="info")
+            Gtk.Settings.get_default().set_property("gtk-enable-animations", False)
+        with metrics.timed("startup.present"):
+            win = self.props.active_window
+            if not win:
+                with metrics.timed("startup.window"):
+                    win = WelcomeWindow(application=self)
+                self.win = win
+                win.add_tick_callback(self.on_first_frame)
+            win.present()
+
+    def on_first_frame(self, widget, frame_clock) -> bool:
+        metrics.since_start("startup.first_frame")
+        return GLib.SOURCE_REMOVE
+
+    def on_shutdown(self, app) -> None:
+        try:
+            metrics.save()
+        except OSError as e:
+            lp(f"Could not save metrics: {e}", mode="warn")
+
+    @metrics.timed("dialog.preferences")
     def on_preferences_action(self, widget, _) -> None:
         """Callback for the app.preferences action."""
         preferences: Adw.PreferencesWindow = Preferences()
         preferences.present()
 
+    @metrics.timed("dialog.about")
     def on_about_action(self, widget, py) -> None:
         """Callback for the app.about action."""
         about = Adw.AboutWindow(
@@ -91,6 +118,40 @@ class WelcomeApp(Adw.Application):
         about.add_acknowledgement_section(_("Special thanks to"), ["Shivanandvp"])
         about.present()
 
+    def on_export_diagnostics_action(self, widget, param) -> None:
+        """Callback for the app.export_diagnostics action."""
+        self.diagnostics_chooser = Gtk.FileChooserNative(
+            title=_("Export diagnostics"),
+            transient_for=self.props.active_window,
+            action=Gtk.FileChooserAction.SAVE,
+            modal=True,
+        )
+        self.diagnostics_chooser.set_current_name(get_default_bundle_name())
+        self.diagnostics_chooser.connect(
+            "response", self.on_diagnostics_chooser_response
+        )
+        self.diagnostics_chooser.show()
+
+    def on_diagnostics_chooser_response(self, chooser, response) -> None:
+        if response == Gtk.ResponseType.ACCEPT:
+            export_diagnostic_bundle(
+                chooser.get_file().get_path(), self.on_diagnostics_exported
+            )
+        self.diagnostics_chooser = None
+
+    def on_diagnostics_exported(self, output_path, error) -> None:
+        if error is None:
+            body = _("Diagnostics were saved to {}").format(output_path)
+        else:
+            body = _("Diagnostics could not be saved: {}").format(error)
+        dialog = Adw.MessageDialog(
+            heading=_("Export diagnostics"),
+            body=body,
+            transient_for=self.props.active_window,
+        )
+        dialog.add_response("ok", _("OK"))
+        dialog.present()
+
     def create_action(self, name, callback, shortcuts=None) -> None:
         action = Gio.SimpleAction.new(name, None)
         action.connect("activate", callback)
@@ -104,15 +165,33 @@ class Preferences(Adw.PreferencesWindow):
     __gtype_name__ = "preferences_window"
 
     autolaunch: Gtk.Switch = Gtk.Template.Child()
+    prefetch: Gtk.Switch = Gtk.Template.Child()
 
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
-        # set autolaunch to the value in settings
-        self.autolaunch.set_active(settings_get("autostart", True))
-        self.autolaunch.connect("state-set", self.on_autolaunch_toggled)
+        # keep autolaunch in sync with the setting
+        app_settings.bind(
+            "autostart", self.autolaunch, "active", Gio.SettingsBindFlags.DEFAULT
+        )
+        # prefetching is a system wide timer rather than a user setting, the
+        # switch stays insensitive until systemctl has reported its state
+        self.prefetch.set_sensitive(False)
+        self.prefetch_handler = self.prefetch.connect(
+            "state-set", self.on_prefetch_toggled
+        )
+        is_prefetch_enabled(self.on_prefetch_state)
+
+    def on_prefetch_toggled(self, button, state) -> bool:
+        button.set_sensitive(False)
+        change_prefetch(state, self.on_prefetch_state)
+        # The state follows once pkexec systemctl has finished
+        return True
 
-    def on_autolaunch_toggled(self, button, *_) -> None:
-        change_autolaunch(button.get_active())
+    def on_prefetch_state(self, enabled: bool) -> None:
+        with self.prefetch.handler_block(self.prefetch_handler):
+            self.prefetch.set_active(enabled)
+            self.prefetch.set_state(enabled)
+        self.prefetch.set_sensitive(True)
 
 
 @Gtk.Template(resource_path="/com/radxa/welcome/ui/window.ui")
@@ -134,7 +213,7 @@ class WelcomeWindow(Adw.Window):
         super().__init__(**kwargs)
         add_custom_styling(self, css_provider)
 
-        if settings_get("fist_run", True):
+        if settings_get("first-run"):
             self.stack.set_visible_child_name("welcome_page")
             self.header_bar.set_visible(False)
             self.carousel_indicator.set_visible(False)
@@ -142,8 +221,10 @@ class WelcomeWindow(Adw.Window):
             self.stack.set_visible_child_name("content_page")
 
         # Carousel setup
-        self.links_page = LinksPage(window=self)
-        self.apps_page = AppsPage(window=self)
+        with metrics.timed("startup.links_page"):
+            self.links_page = LinksPage(window=self)
+        with metrics.timed("startup.apps_page"):
+            self.apps_page = AppsPage(window=self)
         self.pages: list = [self.links_page, self.apps_page]
 
         self.carousel.append(self.links_page)
@@ -151,8 +232,9 @@ class WelcomeWindow(Adw.Window):
         self.carousel.connect("page-changed", self.update_buttons)
 
         # Auto launch switch
-        self.autolaunch.set_active(settings_get("autostart", True))
-        self.autolaunch.connect("state-set", self.on_autolaunch_toggled)
+        app_settings.bind(
+            "autostart", self.autolaunch, "active", Gio.SettingsBindFlags.DEFAULT
+        )
 
         # Connect buttons
         self.welcome_button.connect("clicked", self.on_welcome_button_clicked)
@@ -174,24 +256,23 @@ class WelcomeWindow(Adw.Window):
     @debounce(0.5)
     def on_next_button_clicked(self, button) -> None:
         curr_page: int = int(self.carousel.get_position())
-        self.carousel.scroll_to(self.pages[curr_page + 1], True)
+        self.carousel.scroll_to(self.pages[curr_page + 1], not is_reduced_motion())
         self.update_buttons()
 
     @debounce(0.5)
     def on_previous_button_clicked(self, button) -> None:
         curr_page: int = int(self.carousel.get_position())
-        self.carousel.scroll_to(self.pages[curr_page - 1], True)
+        self.carousel.scroll_to(self.pages[curr_page - 1], not is_reduced_motion())
         self.update_buttons()
 
     def on_welcome_button_clicked(self, button, *_) -> None:
         self.stack.set_visible_child_name("content_page")
         self.header_bar.set_visible(True)
         self.carousel_indicator.set_visible(True)
-        change_autolaunch(self.autolaunch.get_active())
-        settings_set("fist_run", False)
-
-    def on_autolaunch_toggled(self, button, *_) -> None:
-        change_autolaunch(button.get_active())
+        # changed::autostart does not fire while the key keeps its default, so
+        # create the desktop entry for a first run here
+        update_autostart_entry(settings_get("autostart"))
+        settings_set("first-run", False)
 
 
 @Gtk.Template(resource_path="/com/radxa/welcome/ui/links_page.ui")
@@ -236,20 +317,22 @@ class LinksPage(Adw.Bin):
             path.join(path.dirname(__file__), "data/assets/discourse-icon.svg")
         )
 
+    @metrics.timed("links.discord")
     def on_discord_button_clicked(self, button) -> None:
         open("https://rock.sh/go", new=2)
 
+    @metrics.timed("links.website")
     def on_website_button_clicked(self, button) -> None:
         open("https://radxa.com/", new=2)
 
+    @metrics.timed("links.forums")
     def on_forums_button_clicked(self, button) -> None:
         open("https://forum.radxa.com/", new=2)
 
+    @metrics.timed("links.docs")
     def on_docs_button_clicked(self, button) -> None:
-        if getlocale()[0] == "zh_CN":
-            open("https://docs.radxa.com/", new=2)
-        else:
-            open("https://docs.radxa.com/en/", new=2)
+        docs: dict = get_device_profile()["docs"]
+        open(docs.get(getlocale()[0], docs["en"]), new=2)
 
 
 @Gtk.Template(resource_path="/com/radxa/welcome/ui/apps_page.ui")
@@ -272,17 +355,35 @@ class AppsPage(Adw.Bin):
         self.task_manager_button.connect("clicked", self.on_task_manager_button_clicked)
         self.settings_button.connect("clicked", self.on_settings_button_clicked)
 
+        # Only show what the device profile recommends
+        profile: dict = get_device_profile()
+        app_buttons: dict = {
+            "software_center": self.software_button,
+            "terminal": self.terminal_button,
+            "task_manager": self.task_manager_button,
+            "settings": self.settings_button,
+        }
+        for app_type, app_button in app_buttons.items():
+            # The button shares a box with its label
+            app_button.get_parent().set_visible(app_type in profile["apps"])
+        self.rsetup_button.get_parent().set_visible(profile["rsetup"])
+
+    @metrics.timed("apps.rsetup")
     def on_rsetup_button_clicked(self, button) -> None:
-        lrun(["gtk-launch", "rsetup"], wait=False)
+        launch_app("rsetup")
 
+    @metrics.timed("apps.software")
     def on_software_button_clicked(self, button) -> None:
         check_installed("software_center", window=self.window)
 
+    @metrics.timed("apps.terminal")
     def on_terminal_button_clicked(self, button) -> None:
         check_installed("terminal", window=self.window)
 
+    @metrics.timed("apps.task_manager")
     def on_task_manager_button_clicked(self, button) -> None:
         check_installed("task_manager", window=self.window)
 
+    @metrics.timed("apps.settings")
     def on_settings_button_clicked(self, button) -> None:
         check_installed("settings", window=self.window)
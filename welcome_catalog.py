@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# This module only uses the standard library so it can be used by jobs that
+# run outside of the desktop session, e.g. as root from a systemd timer.
+#
+# Run as a script it refreshes the system wide catalog cache. The cache is
+# keyed on the dpkg status file, so sessions can answer which app of each
+# category is installed with a stat and a small read until packages change.
+# The APT hook in data/apt refreshes it after every apt run, and postinst
+# writes the first one with --after-dpkg.
+
+import os
+import sys
+import json
+import fcntl
+import hashlib
+import subprocess
+from time import monotonic, sleep
+from typing import Optional
+
+DPKG_STATUS = "/var/lib/dpkg/status"
+DPKG_LOCK = "/var/lib/dpkg/lock"
+CACHE_DIR = "/var/cache/radxa-welcome"
+CACHE_FILE = os.path.join(CACHE_DIR, "apps.json")
+
+# {app_type: {pretty_name: [pkgname, exec_name]}}
+apps = {
+    "settings": {
+        "Gnome Settings": ["gnome-control-center", "org.gnome.Settings"],
+        "KDE settings": ["systemsettings", "kdesystemsettings"],
+        "XFCE Settings": ["xfce4-settings-manager", "xfce4-settings-manager"],
+        "Cinnamon Settings": ["cinnamon-settings", "cinnamon-settings"],
+    },
+    "terminal": {
+        "Gnome Terminal": ["gnome-terminal", "org.gnome.Terminal"],
+        "Konsole": ["konsole", "org.kde.konsole"],
+        "XFCE4 Terminal": ["xfce4-terminal", "xfce4-terminal"],
+    },
+    "software_center": {
+        "Gnome Software": ["gnome-software", "org.gnome.Software"],
+        "Discover (KDE)": ["plasma-discover", "org.kde.discover"],
+    },
+    "task_manager": {
+        "Gnome System Monitor": ["gnome-system-monitor", "gnome-system-monitor"],
+        "KDE System Monitor": ["plasma-systemmonitor", "org.kde.plasma-systemmonitor"],
+        "XFCE Task Manager": ["xfce4-taskmanager", "xfce4-taskmanager"],
+    },
+}
+
+
+def query_installed(packages: list) -> set:
+    """
+    Check which packages are installed with a single dpkg-query call
+
+        :param packages:  The package names to check
+        :type packages: list
+        :return:  The names of the installed packages
+        :rtype: set
+    """
+    result = subprocess.run(
+        ["dpkg-query", "-W", "-f=${Package} ${db:Status-Status}\\n", *packages],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    installed = set()
+    for line in result.stdout.splitlines():
+        package, _sep, status = line.partition(" ")
+        if status == "installed":
+            installed.add(package)
+    return installed
+
+
+def get_catalog_digest() -> str:
+    """Return a digest of the catalog, so a changed catalog invalidates the cache."""
+    catalog = json.dumps(apps, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(catalog).hexdigest()[:16]
+
+
+def get_status_fingerprint() -> str:
+    """Fingerprint the dpkg status file without reading it."""
+    status = os.stat(DPKG_STATUS)
+    return f"{status.st_ino}-{status.st_size}-{status.st_mtime_ns}"
+
+
+def resolve_catalog() -> dict:
+    """
+    Resolve the installed application of every category
+
+        :return:  {app_type: package name of the first installed candidate, or None}
+        :rtype: dict
+    """
+    installed = query_installed(get_catalog_packages())
+    resolved = {}
+    for app_type, candidates in apps.items():
+        resolved[app_type] = next(
+            (
+                pkgname
+                for pkgname, _exec_name in candidates.values()
+                if pkgname in installed
+            ),
+            None,
+        )
+    return resolved
+
+
+def write_catalog_cache(cache_file: str = CACHE_FILE) -> None:
+    """
+    Write the system wide catalog cache
+
+        Does the following:
+        - Resolves the catalog with a single dpkg-query call
+        - Writes it with the dpkg status fingerprint and the catalog digest
+        - Replaces the cache atomically so readers never see a partial file
+    """
+    fingerprint = get_status_fingerprint()
+    cache = {
+        "fingerprint": fingerprint,
+        "catalog": get_catalog_digest(),
+        "resolved": resolve_catalog(),
+    }
+    if get_status_fingerprint() != fingerprint:
+        # dpkg is still running, the next hook invocation will catch up
+        return
+    os.makedirs(os.path.dirname(cache_file), mode=0o755, exist_ok=True)
+    partial_file = cache_file + ".tmp"
+    with open(partial_file, "w") as output:
+        json.dump(cache, output)
+    os.chmod(partial_file, 0o644)
+    os.replace(partial_file, cache_file)
+
+
+# (fingerprint, resolved) of the last cache read in this process
+_cached_resolution: tuple = (None, None)
+
+
+def read_catalog_cache(cache_file: str = CACHE_FILE) -> Optional[dict]:
+    """
+    Read the system wide catalog cache
+
+        :return:  The cached resolution, or None if the cache is missing or stale
+        :rtype: dict
+    """
+    global _cached_resolution
+    try:
+        fingerprint = get_status_fingerprint()
+    except OSError:
+        return None
+    if _cached_resolution[0] == fingerprint:
+        return _cached_resolution[1]
+    try:
+        with open(cache_file, "r") as cache_json:
+            cache = json.load(cache_json)
+    except (OSError, ValueError):
+        return None
+    if (
+        cache.get("fingerprint") != fingerprint
+        or cache.get("catalog") != get_catalog_digest()
+    ):
+        return None
+    _cached_resolution = (fingerprint, cache["resolved"])
+    return cache["resolved"]
+
+
+def get_catalog_packages() -> list:
+    """Return the package name of every candidate in the catalog."""
+    return [
+        pkgname
+        for candidates in apps.values()
+        for pkgname, _exec_name in candidates.values()
+    ]
+
+
+def wait_for_dpkg(timeout: float = 600) -> bool:
+    """
+    Wait until dpkg has released its database lock
+
+        :param timeout:  How long to wait in seconds
+        :type timeout: float
+        :return:  Whether dpkg released the lock in time
+        :rtype: bool
+    """
+    deadline = monotonic() + timeout
+    with open(DPKG_LOCK, "r+") as lock:
+        while True:
+            try:
+                fcntl.lockf(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                if monotonic() > deadline:
+                    return False
+                sleep(1)
+                continue
+            fcntl.lockf(lock, fcntl.LOCK_UN)
+            return True
+
+
+if __name__ == "__main__":
+    if "--after-dpkg" in sys.argv:
+        # Run from postinst: dpkg rewrites its status file once the maintainer
+        # script returns, so write the cache from a detached child afterwards
+        if os.fork():
+            sys.exit(0)
+        os.setsid()
+        if not wait_for_dpkg():
+            sys.exit(0)
+    try:
+        write_catalog_cache()
+    except OSError as e:
+        print(f"radxa-welcome: could not update {CACHE_FILE}: {e}")
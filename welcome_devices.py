@@ -0,0 +1,125 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+from os import path
+from functools import lru_cache
+
+from welcome_support import lp, detect_compatible
+
+# Used when the packaged database cannot be read
+FALLBACK_PROFILE = {
+    "name": "Generic",
+    "docs": {
+        "en": "https://docs.radxa.com/en/",
+        "zh_CN": "https://docs.radxa.com/",
+    },
+    "apps": ["software_center", "terminal", "task_manager", "settings"],
+    "rsetup": True,
+}
+
+
+class DeviceProfileIndex:
+    """
+    Index of device profiles keyed on devicetree compatible strings
+
+        Compatible patterns are either exact strings or prefixes ending in "*".
+        Exact patterns go into one dictionary and prefixes into another, so a
+        lookup is one probe per compatible string plus one per distinct prefix
+        length. The longest matching prefix wins.
+    """
+
+    def __init__(self, default: dict, profiles: list) -> None:
+        self.default: dict = default
+        self.exact: dict = {}
+        self.prefixes: dict = {}
+        for profile in profiles:
+            merged = {**default, **profile}
+            # Profiles may override single languages, the rest fall back
+            merged["docs"] = {**default.get("docs", {}), **profile.get("docs", {})}
+            for pattern in profile.get("compatible", []):
+                if pattern.endswith("*"):
+                    self.prefixes.setdefault(pattern[:-1], merged)
+                else:
+                    self.exact.setdefault(pattern, merged)
+        self.prefix_lengths: list = sorted(
+            {len(prefix) for prefix in self.prefixes}, reverse=True
+        )
+
+    def lookup(self, compatible: list) -> dict:
+        """
+        Find the profile for a device
+
+            Does the following:
+            - Walks the compatible strings from most to least specific
+            - Returns the first exact match, else the longest prefix match
+            - Falls back to the default profile
+
+            :param compatible:  The devicetree compatible strings of the device
+            :type compatible: list
+            :return:  The matching profile
+            :rtype: dict
+        """
+        for entry in compatible:
+            profile = self.exact.get(entry)
+            if profile is not None:
+                return profile
+            for length in self.prefix_lengths:
+                if length <= len(entry):
+                    profile = self.prefixes.get(entry[:length])
+                    if profile is not None:
+                        return profile
+        return self.default
+
+
+def load_device_profiles(profiles_file: str) -> DeviceProfileIndex:
+    """
+    Load the device profile database
+
+        :param profiles_file:  Path of the profile database
+        :type profiles_file: str
+        :return:  The indexed profiles
+        :rtype: DeviceProfileIndex
+    """
+    with open(profiles_file, "r") as database:
+        data = json.load(database)
+    return DeviceProfileIndex(data["default"], data.get("profiles", []))
+
+
+@lru_cache(maxsize=None)
+def get_device_profile() -> dict:
+    """
+    Get the profile of the device we are running on
+
+        Does the following:
+        - Loads the packaged profile database
+        - Looks up the devicetree compatible strings of this device in it
+    """
+    profiles_file = path.join(
+        path.dirname(__file__), "data", "devices", "profiles.json"
+    )
+    try:
+        index = load_device_profiles(profiles_file)
+    except (OSError, ValueError, KeyError) as e:
+        lp(f"Could not load device profiles from {profiles_file}: {e}", mode="error")
+        index = DeviceProfileIndex(FALLBACK_PROFILE, [])
+    compatible = detect_compatible()
+    profile = index.lookup(compatible)
+    lp(f"Device profile: {profile['name']} ({', '.join(compatible)})", mode="debug")
+    return profile
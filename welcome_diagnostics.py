@@ -0,0 +1,220 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import os
+import tarfile
+from datetime import datetime
+from threading import Thread
+from time import time
+from typing import Callable, Optional
+
+from welcome_metrics import get_metrics_file
+from welcome_support import (
+    lp,
+    apps,
+    check_app_installed,
+    get_info_for_welcome,
+    get_log_dir,
+    get_settings_dump,
+    get_autostart_file,
+)
+
+from gi.repository import GLib  # type: ignore
+
+# Per-section size caps in bytes. Text sections keep their head, files keep
+# their tail so the most recent log lines always make it into the bundle.
+SECTION_LIMITS = {
+    "system": 64 * 1024,
+    "log": 512 * 1024,
+    "catalog": 64 * 1024,
+    "settings": 64 * 1024,
+    "autostart": 16 * 1024,
+    "metrics": 64 * 1024,
+}
+MAX_LOG_FILES = 5
+
+
+def get_default_bundle_name() -> str:
+    return datetime.now().strftime("radxa-welcome-diagnostics-%Y-%m-%d-%H-%M-%S.tar.gz")
+
+
+def get_recent_logs(count: int = MAX_LOG_FILES) -> list:
+    """
+    Get the most recent log files
+
+        :param count:  The maximum number of log files to return
+        :type count: int
+        :return:  Paths of the log files, newest first
+        :rtype: list
+    """
+    log_dir = get_log_dir()
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(log_dir)
+            if entry.is_file() and entry.name.endswith(".log")
+        ]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [entry.path for entry in entries[:count]]
+
+
+def get_app_catalog_state() -> str:
+    """
+    Describe which application of each catalog category resolves on this system
+
+        Does the following:
+        - Checks every candidate package of every category
+        - Marks the first installed candidate as the resolved application
+    """
+    state = ""
+    for app_type, candidates in apps.items():
+        resolved = None
+        lines = ""
+        for pretty_name, (pkgname, exec_name) in candidates.items():
+            installed = check_app_installed(pkgname)
+            if installed and resolved is None:
+                resolved = pretty_name
+            status = "installed" if installed else "missing"
+            lines += f"  {pretty_name}: {pkgname} ({exec_name}) {status}\n"
+        state += f"{app_type}: {resolved}\n{lines}"
+    return state
+
+
+def _add_text(tar: tarfile.TarFile, name: str, text: str, limit: int) -> None:
+    data = text.encode("utf-8", errors="replace")[:limit]
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time())
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_file_tail(tar: tarfile.TarFile, name: str, file_path, limit: int) -> None:
+    try:
+        with open(file_path, "rb") as source:
+            stat = os.fstat(source.fileno())
+            start = max(0, stat.st_size - limit)
+            source.seek(start)
+            info = tarfile.TarInfo(name)
+            info.size = stat.st_size - start
+            info.mtime = int(stat.st_mtime)
+            info.mode = 0o644
+            # addfile copies info.size bytes in fixed-size chunks
+            tar.addfile(info, source)
+    except OSError as e:
+        lp(f"Skipping {file_path} in diagnostic bundle: {e}", mode="debug")
+
+
+def write_diagnostic_bundle(output_path: str, settings: str) -> None:
+    """
+    Write a compressed diagnostic bundle
+
+        Does the following:
+        - Streams a gzip compressed tar archive to a temporary file next to
+          output_path, one capped section at a time
+        - Moves the finished archive to output_path
+
+        :param output_path:  Where to write the bundle
+        :type output_path: str
+        :param settings:  The settings dump to include
+        :type settings: str
+    """
+    root = os.path.basename(output_path).split(".")[0] or "radxa-welcome-diagnostics"
+    partial_path = output_path + ".part"
+    lp(f"Writing diagnostic bundle to {output_path}..", mode="info")
+    try:
+        with open(partial_path, "wb") as output:
+            with tarfile.open(fileobj=output, mode="w|gz") as tar:
+                _add_text(
+                    tar,
+                    f"{root}/system_info.txt",
+                    get_info_for_welcome(),
+                    SECTION_LIMITS["system"],
+                )
+                _add_text(
+                    tar,
+                    f"{root}/app_catalog.txt",
+                    get_app_catalog_state(),
+                    SECTION_LIMITS["catalog"],
+                )
+                _add_text(
+                    tar,
+                    f"{root}/settings.txt",
+                    settings,
+                    SECTION_LIMITS["settings"],
+                )
+                _add_file_tail(
+                    tar,
+                    f"{root}/com.radxa.welcome.desktop",
+                    get_autostart_file(),
+                    SECTION_LIMITS["autostart"],
+                )
+                _add_file_tail(
+                    tar,
+                    f"{root}/metrics.jsonl",
+                    get_metrics_file(),
+                    SECTION_LIMITS["metrics"],
+                )
+                for log_file in get_recent_logs():
+                    _add_file_tail(
+                        tar,
+                        f"{root}/logs/{os.path.basename(log_file)}",
+                        log_file,
+                        SECTION_LIMITS["log"],
+                    )
+        os.replace(partial_path, output_path)
+    except Exception:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    lp("Diagnostic bundle written.", mode="info")
+
+
+def export_diagnostic_bundle(
+    output_path: str, callback: Callable[[str, Optional[Exception]], None]
+) -> None:
+    """
+    Write a diagnostic bundle without blocking the UI thread
+
+        Does the following:
+        - Writes the bundle from a worker thread
+        - Calls callback(output_path, error) on the main loop when done
+
+        :param output_path:  Where to write the bundle
+        :type output_path: str
+        :param callback:  Called with the output path and the error, if any
+    """
+    # GSettings is read here, on the main loop, rather than from the worker
+    settings = get_settings_dump()
+
+    def worker() -> None:
+        error = None
+        try:
+            write_diagnostic_bundle(output_path, settings)
+        except Exception as e:
+            lp(f"Failed to write diagnostic bundle: {e}", mode="error")
+            error = e
+        GLib.idle_add(callback, output_path, error)
+
+    Thread(target=worker, daemon=True).start()
@@ -0,0 +1,252 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# This module only uses the standard library so `radxa-welcome --metrics`
+# can run without starting GTK, logging or settings.
+
+import os
+import json
+import subprocess
+from bisect import bisect_left
+from functools import lru_cache, wraps
+from datetime import datetime
+from threading import Lock
+from time import monotonic, time
+from typing import Optional
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket is +inf
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Number of sessions kept in the metrics file
+MAX_SESSIONS = 50
+
+
+def get_metrics_file() -> str:
+    """Return the path of the rolling metrics file."""
+    return os.path.join(os.path.expanduser("~"), ".cache", "welcome", "metrics.jsonl")
+
+
+@lru_cache(maxsize=None)
+def get_build_id() -> str:
+    """
+    Identify the running build
+
+        Does the following:
+        - Uses the installed radxa-welcome package version
+        - Falls back to when this file was written when running from source
+          or without dpkg
+    """
+    source_tree = os.path.exists(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), "meson.build")
+    )
+    if not source_tree:
+        try:
+            result = subprocess.run(
+                ["dpkg-query", "-W", "-f", "${Version}", "radxa-welcome"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+            if result.returncode == 0 and result.stdout:
+                return result.stdout
+        except OSError:
+            pass
+    mtime = os.stat(__file__).st_mtime
+    return "source-" + datetime.fromtimestamp(mtime).strftime("%Y-%m-%d-%H-%M-%S")
+
+
+class Histogram:
+    """Latency histogram with the fixed BUCKETS_MS buckets"""
+
+    def __init__(self, counts=None, total_ms: float = 0.0) -> None:
+        self.counts: list = counts or [0] * (len(BUCKETS_MS) + 1)
+        self.total_ms: float = total_ms
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.total_ms += ms
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_ms += other.total_ms
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, inf if unbounded."""
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= target:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else float("inf")
+        return 0.0
+
+
+class Timer:
+    """Observe the wall time of a block or function into a histogram"""
+
+    def __init__(self, registry: "MetricsRegistry", name: str) -> None:
+        self.registry = registry
+        self.name = name
+
+    def __call__(self, func):
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            # A fresh timer per call, so threads and recursion don't share it
+            with Timer(self.registry, self.name):
+                return func(*args, **kwargs)
+
+        return timed_func
+
+    def __enter__(self) -> "Timer":
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.registry.observe(self.name, (monotonic() - self.start) * 1000)
+        return False
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms
+
+        Does the following:
+        - Counts events and records latencies by name
+        - Appends a snapshot per session to a rolling file on save
+    """
+
+    def __init__(self) -> None:
+        self.start_time: float = monotonic()
+        self.counters: dict = {}
+        self.histograms: dict = {}
+        self.lock = Lock()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, ms: float) -> None:
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).observe(ms)
+
+    def since_start(self, name: str) -> None:
+        """Observe the time since the process started."""
+        self.observe(name, (monotonic() - self.start_time) * 1000)
+
+    def timed(self, name: str) -> Timer:
+        return Timer(self, name)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "time": int(time()),
+                "build": get_build_id(),
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: [round(histogram.total_ms, 1), histogram.counts]
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def save(self, metrics_file: Optional[str] = None) -> None:
+        """
+        Append this session to the rolling metrics file
+
+            Does the following:
+            - Keeps the newest MAX_SESSIONS sessions, one JSON object per line
+            - Replaces the file atomically
+
+            :param metrics_file:  The file to write to, defaults to get_metrics_file()
+            :type metrics_file: str
+        """
+        metrics_file = metrics_file or get_metrics_file()
+        if not self.counters and not self.histograms:
+            return
+        lines = [json.dumps(self.snapshot(), separators=(",", ":"))]
+        try:
+            with open(metrics_file, "r") as previous:
+                lines = previous.read().splitlines()[-(MAX_SESSIONS - 1) :] + lines
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+        with open(metrics_file + ".tmp", "w") as output:
+            output.write("\n".join(lines) + "\n")
+        os.replace(metrics_file + ".tmp", metrics_file)
+
+
+def load_sessions(metrics_file: Optional[str] = None) -> list:
+    """Load the sessions from the rolling metrics file, skipping broken lines."""
+    sessions = []
+    try:
+        with open(metrics_file or get_metrics_file(), "r") as metrics:
+            for line in metrics:
+                try:
+                    sessions.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return sessions
+
+
+def format_metrics(sessions: list) -> str:
+    """
+    Summarise sessions per build
+
+        Counters are summed and histograms merged across the sessions of each
+        build. Quantiles are reported as bucket upper bounds.
+    """
+    builds: dict = {}
+    for session in sessions:
+        build = builds.setdefault(
+            session.get("build", "unknown"),
+            {"sessions": 0, "counters": {}, "histograms": {}},
+        )
+        build["sessions"] += 1
+        for name, value in session.get("counters", {}).items():
+            build["counters"][name] = build["counters"].get(name, 0) + value
+        for name, (total_ms, counts) in session.get("histograms", {}).items():
+            build["histograms"].setdefault(name, Histogram()).merge(
+                Histogram(counts, total_ms)
+            )
+
+    output = ""
+    for build_id, build in builds.items():
+        output += f"Build {build_id} ({build['sessions']} sessions)\n"
+        for name, value in sorted(build["counters"].items()):
+            output += f"  {name}: {value}\n"
+        for name, histogram in sorted(build["histograms"].items()):
+            mean = histogram.total_ms / histogram.count if histogram.count else 0.0
+            output += (
+                f"  {name}: n={histogram.count} mean={mean:.1f}ms"
+                f" p50<={histogram.quantile(0.5)}ms"
+                f" p90<={histogram.quantile(0.9)}ms"
+                f" p99<={histogram.quantile(0.99)}ms\n"
+            )
+    return output or "No metrics recorded yet.\n"
+
+
+def dump_metrics() -> None:
+    print(format_metrics(load_sessions()), end="")
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,215 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Downloads, but does not install, the preferred application of every catalog
+# category that has nothing installed, so a later install from the welcome app
+# only has to unpack. Run as root by radxa-welcome-prefetch.timer once the user
+# opts in from the preferences.
+
+import os
+import glob
+import shutil
+import logging
+import argparse
+import subprocess
+
+from welcome_catalog import apps, query_installed, get_catalog_packages
+
+logger = logging.getLogger("radxa-welcome-prefetch")
+
+PREFETCH_TIMER = "radxa-welcome-prefetch.timer"
+
+
+def is_on_ac_power() -> bool:
+    """
+    Check if the system runs on AC power
+
+        Boards without any battery are always considered to be on AC power.
+    """
+    on_battery = False
+    for supply in glob.glob("/sys/class/power_supply/*"):
+        try:
+            with open(os.path.join(supply, "type"), "r") as type_file:
+                supply_type = type_file.read().strip()
+            with open(os.path.join(supply, "online"), "r") as online_file:
+                online = online_file.read().strip() == "1"
+        except OSError:
+            continue
+        if supply_type == "Mains" and online:
+            return True
+        if supply_type == "Battery":
+            on_battery = True
+    return not on_battery
+
+
+def is_idle(max_load: float) -> bool:
+    """
+    Check if the system is idle
+
+        :param max_load:  The highest 1 minute load per CPU that counts as idle
+        :type max_load: float
+    """
+    return os.getloadavg()[0] / (os.cpu_count() or 1) <= max_load
+
+
+def get_prefetch_candidates() -> list:
+    """Return the preferred package of every category without an installed app."""
+    installed = query_installed(get_catalog_packages())
+    candidates = []
+    for app_type, app_candidates in apps.items():
+        packages = [pkgname for pkgname, _exec_name in app_candidates.values()]
+        if not installed.intersection(packages):
+            logger.info(f"No {app_type} installed, prefetching {packages[0]}")
+            candidates.append(packages[0])
+    return candidates
+
+
+def get_download_size(apt_options: list, packages: list) -> int:
+    """
+    Get how many bytes apt would need to download to install packages
+
+        Packages that are already in the archive cache are not counted.
+    """
+    result = subprocess.run(
+        ["apt-get", *apt_options, "install", "-y", "--print-uris", *packages],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    size = 0
+    for line in result.stdout.splitlines():
+        # 'uri' filename size hash
+        fields = line.split()
+        if line.startswith("'") and len(fields) >= 3 and fields[2].isdigit():
+            size += int(fields[2])
+    return size
+
+
+def prefetch(args: argparse.Namespace) -> int:
+    """
+    Download the prefetch candidates into the apt archive cache
+
+        Does the following:
+        - Skips the run unless the system is idle and on AC power
+        - Checks the download against the size and free space limits
+        - Downloads the packages with a bandwidth limit
+
+        :return:  The exit code
+        :rtype: int
+    """
+    if not args.force:
+        if not is_on_ac_power():
+            logger.info("Not on AC power, skipping.")
+            return 0
+        if not is_idle(args.max_load):
+            logger.info("System is busy, skipping.")
+            return 0
+
+    packages = get_prefetch_candidates()
+    if not packages:
+        logger.info("Nothing to prefetch.")
+        return 0
+
+    apt_options = []
+    for option in args.apt_option:
+        apt_options += ["-o", option]
+    if args.archives:
+        os.makedirs(os.path.join(args.archives, "partial"), exist_ok=True)
+        apt_options += ["-o", f"Dir::Cache::Archives={args.archives}"]
+    for protocol in ("http", "https"):
+        apt_options += ["-o", f"Acquire::{protocol}::Dl-Limit={args.bandwidth}"]
+
+    available = []
+    download_size = 0
+    for package in packages:
+        try:
+            download_size += get_download_size(apt_options, [package])
+            available.append(package)
+        except subprocess.CalledProcessError:
+            logger.warning(f"{package} can not be installed, skipping it.")
+    packages = available
+    if not packages:
+        logger.info("None of the candidates are available.")
+        return 0
+    if download_size == 0:
+        logger.info("Everything is already in the archive cache.")
+        return 0
+    if download_size > args.max_download * 1024 * 1024:
+        logger.warning(
+            f"Download of {download_size} bytes exceeds the limit of "
+            f"{args.max_download} MiB, skipping."
+        )
+        return 0
+    archives = args.archives or "/var/cache/apt/archives"
+    free = shutil.disk_usage(archives).free
+    if free - download_size < args.min_free * 1024 * 1024:
+        logger.warning(
+            f"Download of {download_size} bytes would leave less than "
+            f"{args.min_free} MiB free in {archives}, skipping."
+        )
+        return 0
+
+    logger.info(f"Downloading {download_size} bytes for {', '.join(packages)}..")
+    if args.dry_run:
+        return 0
+    result = subprocess.run(
+        ["apt-get", *apt_options, "install", "-y", "--download-only", *packages]
+    )
+    return result.returncode
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Prefetch Radxa Welcome install candidates into the apt cache."
+    )
+    parser.add_argument(
+        "--bandwidth", type=int, default=256, help="download limit in KiB/s"
+    )
+    parser.add_argument(
+        "--max-download", type=int, default=512, help="largest download in MiB"
+    )
+    parser.add_argument(
+        "--min-free", type=int, default=1024, help="free space to keep in MiB"
+    )
+    parser.add_argument(
+        "--max-load",
+        type=float,
+        default=0.25,
+        help="highest 1 minute load average per CPU that counts as idle",
+    )
+    parser.add_argument(
+        "--archives", help="apt archive cache, defaults to the apt configuration"
+    )
+    parser.add_argument(
+        "--apt-option",
+        action="append",
+        default=[],
+        metavar="OPTION=VALUE",
+        help="extra apt option, e.g. to point at a local copy:/ test repository",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="skip the idle and AC power checks"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="check the limits only")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)8s: %(message)s")
+    exit(prefetch(parse_args()))
@@ -0,0 +1,261 @@
+#! /usr/bin/python3
+#
+# Copyright 2024 Radxa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# GTK picks its renderer when it initialises, so select_renderer() has to run
+# before anything imports Gtk. Each renderer is benchmarked offscreen in a child
+# process; the result, or that benchmarking failed, is cached per device and
+# driver.
+
+import os
+import sys
+import json
+import glob
+import subprocess
+from statistics import median
+from time import monotonic
+from typing import Optional
+
+RENDERERS = ("ngl", "gl", "cairo")
+# Frames rendered per renderer, and the most time to spend on them
+BENCHMARK_FRAMES = 60
+BENCHMARK_SECONDS = 1.0
+# Offscreen frames include reading the result back, so allow some overhead
+# before calling the measured frame time slower than the display interval
+SLOW_FRAME_FACTOR = 1.25
+# Starts on which a device without any usable renderer benchmarks again, as
+# failures can be temporary, e.g. an autostart before the compositor is ready
+MAX_BENCHMARK_ATTEMPTS = 3
+REDUCED_MOTION_ENV = "RADXA_WELCOME_REDUCED_MOTION"
+
+
+def get_cache_file() -> str:
+    """Return the path of the renderer benchmark cache."""
+    return os.path.join(os.path.expanduser("~"), ".cache", "welcome", "renderer.json")
+
+
+def get_device_key() -> str:
+    """Identify the device and its display drivers."""
+    try:
+        with open("/sys/firmware/devicetree/base/model", "r") as model_file:
+            model = model_file.read().rstrip("\n").rstrip("\x00")
+    except OSError:
+        model = "unknown"
+    drivers = sorted(
+        {
+            os.path.basename(os.path.realpath(driver))
+            for driver in glob.glob("/sys/class/drm/card*/device/driver")
+        }
+    )
+    return f"{model}|{','.join(drivers)}"
+
+
+def is_reduced_motion() -> bool:
+    return os.environ.get(REDUCED_MOTION_ENV) == "1"
+
+
+def benchmark_renderer(launch_script: str, renderer: str) -> Optional[dict]:
+    """
+    Measure the frame times of a renderer
+
+        :param launch_script:  launch.py, started with --benchmark-renderer
+        :type launch_script: str
+        :param renderer:  The renderer to benchmark
+        :type renderer: str
+        :return:  The median frame time and display interval, or None on failure
+    """
+    try:
+        result = subprocess.run(
+            [sys.executable, launch_script, "--benchmark-renderer", renderer],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            timeout=BENCHMARK_SECONDS + 5,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except (subprocess.TimeoutExpired, ValueError, IndexError) as e:
+        print(f"    INFO: Benchmarking the {renderer} renderer failed: {e}")
+        return None
+
+
+def select_renderer(launch_script: str) -> None:
+    """
+    Select the fastest GTK renderer for this device
+
+        Does the following:
+        - Benchmarks every renderer offscreen the first time it runs on a device
+        - Sets GSK_RENDERER to the renderer with the lowest frame time
+        - Asks for reduced motion if even that one misses the display interval
+        - Leaves the choice to GTK if no renderer could be benchmarked, and
+          tries again on the next MAX_BENCHMARK_ATTEMPTS - 1 starts
+
+        Does nothing if GSK_RENDERER is already set, and does not benchmark
+        without a display to connect to.
+
+        :param launch_script:  launch.py, started with --benchmark-renderer
+        :type launch_script: str
+    """
+    if "GSK_RENDERER" in os.environ:
+        return
+    cache_file = get_cache_file()
+    try:
+        with open(cache_file, "r") as cache_json:
+            cache = json.load(cache_json)
+    except (OSError, ValueError):
+        cache = {}
+
+    key = get_device_key()
+    entry = cache.get(key)
+    attempts = entry.get("attempts", 0) if entry is not None else 0
+    if entry is None or (
+        entry["renderer"] is None and attempts < MAX_BENCHMARK_ATTEMPTS
+    ):
+        if not os.environ.get("WAYLAND_DISPLAY") and not os.environ.get("DISPLAY"):
+            # Nothing to benchmark against, and nothing learnt about the device
+            return
+        results = {}
+        for renderer in RENDERERS:
+            result = benchmark_renderer(launch_script, renderer)
+            if result is not None:
+                results[renderer] = result
+        if results:
+            best = min(results, key=lambda renderer: results[renderer]["frame_ms"])
+            cache[key] = {
+                "renderer": best,
+                "reduced_motion": results[best]["frame_ms"]
+                > results[best]["interval_ms"] * SLOW_FRAME_FACTOR,
+                "results": results,
+            }
+            print(f"    INFO: Selected the {best} renderer: {results}")
+        else:
+            # Remembered too, so a device without a usable renderer only pays
+            # for the benchmark on its first few starts
+            cache[key] = {
+                "renderer": None,
+                "reduced_motion": False,
+                "attempts": attempts + 1,
+                "results": {},
+            }
+            print("    INFO: No renderer could be benchmarked, leaving it to GTK")
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, "w") as cache_json:
+                json.dump(cache, cache_json)
+        except OSError as e:
+            print(f"    INFO: Could not cache the renderer: {e}")
+
+    if cache[key]["renderer"]:
+        os.environ["GSK_RENDERER"] = cache[key]["renderer"]
+    if cache[key]["reduced_motion"]:
+        os.environ[REDUCED_MOTION_ENV] = "1"
+
+
+def snapshot_frame(Gtk, Gdk, Gsk, Graphene, layouts: list, progress: float):
+    """
+    Build the render nodes of one frame of a carousel transition
+
+        Two cards with rounded corners, shadows and text, the first sliding
+        out and fading while the second slides in.
+    """
+    width, height = 600, 300
+    snapshot = Gtk.Snapshot()
+    background = Gdk.RGBA()
+    background.parse("#fafafa")
+    snapshot.append_color(background, Graphene.Rect().init(0, 0, width, height))
+    card_color = Gdk.RGBA()
+    card_color.parse("#ffffff")
+    shadow_color = Gdk.RGBA()
+    shadow_color.parse("rgba(0, 0, 0, 0.2)")
+    text_color = Gdk.RGBA()
+    text_color.parse("#303030")
+    for index, layout in enumerate(layouts):
+        offset = (index - progress) * width
+        card = Graphene.Rect().init(offset + 24, 24, width - 48, height - 48)
+        rounded = Gsk.RoundedRect()
+        rounded.init_from_rect(card, 12)
+        snapshot.push_opacity(1 - abs(index - progress))
+        snapshot.append_outset_shadow(rounded, shadow_color, 0, 2, 1, 8)
+        snapshot.push_rounded_clip(rounded)
+        snapshot.append_color(card_color, card)
+        snapshot.save()
+        snapshot.translate(Graphene.Point().init(offset + 48, 48))
+        snapshot.append_layout(layout, text_color)
+        snapshot.restore()
+        snapshot.pop()
+        snapshot.pop()
+    return snapshot.to_node(), Graphene.Rect().init(0, 0, width, height)
+
+
+def run_benchmark(renderer: str) -> None:
+    """
+    Render a carousel transition offscreen and print its frame times
+
+        Nothing is mapped on screen. Prints one line of JSON with the median
+        frame time and the display interval, both in milliseconds.
+
+        :param renderer:  The renderer to benchmark, one of RENDERERS
+        :type renderer: str
+    """
+    import gi
+
+    gi.require_version("Gtk", "4.0")
+    gi.require_version("Gdk", "4.0")
+    gi.require_version("Gsk", "4.0")
+    gi.require_version("Graphene", "1.0")
+    from gi.repository import Gtk, Gdk, Gsk, Graphene  # type: ignore
+
+    renderer_types = {
+        "ngl": Gsk.NglRenderer,
+        "gl": Gsk.GLRenderer,
+        "cairo": Gsk.CairoRenderer,
+    }
+    gsk_renderer = renderer_types[renderer]()
+    # Without a surface the renderer draws into offscreen textures only
+    gsk_renderer.realize(None)
+
+    label = Gtk.Label()
+    layouts = [
+        label.create_pango_layout(f"Radxa Welcome {index}\n" * 4) for index in range(2)
+    ]
+    frame_times = []
+    deadline = monotonic() + BENCHMARK_SECONDS
+    for frame in range(BENCHMARK_FRAMES):
+        if monotonic() > deadline:
+            break
+        start = monotonic()
+        node, viewport = snapshot_frame(
+            Gtk, Gdk, Gsk, Graphene, layouts, frame / BENCHMARK_FRAMES
+        )
+        gsk_renderer.render_texture(node, viewport)
+        frame_times.append((monotonic() - start) * 1000)
+    gsk_renderer.unrealize()
+
+    if not frame_times:
+        return
+    refresh_rate = 60000
+    monitors = Gdk.Display.get_default().get_monitors()
+    if monitors.get_n_items() and monitors.get_item(0).get_refresh_rate() > 0:
+        refresh_rate = monitors.get_item(0).get_refresh_rate()
+    print(
+        json.dumps(
+            {
+                "frame_ms": median(frame_times),
+                "interval_ms": 1000000 / refresh_rate,
+            }
+        )
+    )
@@ -20,6 +20,8 @@
 import gettext
 import logging
 import os
+import json
+import shutil
 import locale
 from os import path
 import subprocess
@@ -29,9 +31,12 @@ from threading import Lock
 from functools import wraps
 from traceback import print_exception
 from datetime import datetime
-from typing import Any
+from collections import deque
+from typing import Any, Callable, Optional
 from pyrunning import LoggingHandler, Command, LogMessage
-from pysetting import JSONConfiguration
+from welcome_metrics import metrics
+from welcome_catalog import apps, read_catalog_cache
+from welcome_prefetch import PREFETCH_TIMER
 
 import gi
 
@@ -66,6 +71,11 @@ def setup_translations(lang: object = None) -> gettext.GNUTranslations:
         return gettext.gettext, gettext.pgettext  # type: ignore
 
 
+def get_log_dir() -> str:
+    """Return the directory the session log files are written to."""
+    return os.path.join(os.path.expanduser("~"), ".cache", "welcome", "logs")
+
+
 def setup_logging() -> logging.Logger:
     """
     Setup logging
@@ -79,7 +89,7 @@ def setup_logging() -> logging.Logger:
     logger = logging.getLogger("radxa-welcome")
     logger.setLevel(logging.DEBUG)
 
-    log_dir = os.path.join(os.path.expanduser("~"), ".cache", "welcome", "logs")
+    log_dir = get_log_dir()
     log_file = os.path.join(
         log_dir, datetime.now().strftime("radxa-welcome-%Y-%m-%d-%H-%M-%S.log")
     )
@@ -138,59 +148,204 @@ def lp(message, write_to_f=True, mode="info") -> None:
         raise ValueError("Invalid mode.")
 
 
-def lrun(cmd: list, wait=True) -> None:
+class ProcessSupervisor:
+    """
+    Launch and reap child processes without blocking the main loop
+
+        Does the following:
+        - Launches children with their output silenced, or piped into the
+          log through asynchronous line reads on the main loop
+        - Reaps children asynchronously through GLib child watches
+        - Keeps track of live children and how long they took to exit
+    """
+
+    def __init__(self, history: int = 32) -> None:
+        # {Gio.Subprocess: [cmd, start time]}, keyed on the process because its
+        # identifier is None once GLib has reaped it, which can happen early
+        self.children: dict = {}
+        self.exit_latencies: deque = deque(maxlen=history)
+        # get_stats() runs on worker threads, everything else on the main loop
+        self.lock = Lock()
+
+    def spawn(
+        self,
+        cmd: list,
+        log_output: bool = False,
+        callback: Optional[Callable[[bool], None]] = None,
+    ) -> Optional[Gio.Subprocess]:
+        """
+        Launch a child process
+
+            :param cmd:  The command to run
+            :type cmd: list
+            :param log_output:  Whether to write the output of the child to the log
+            :type log_output: bool
+            :param callback:  Called on the main loop with whether the child
+                              exited successfully, also if it failed to launch
+            :return:  The child process, or None if it could not be launched
+        """
+        if log_output:
+            flags = Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_MERGE
+        else:
+            flags = (
+                Gio.SubprocessFlags.STDOUT_SILENCE | Gio.SubprocessFlags.STDERR_SILENCE
+            )
+        try:
+            with metrics.timed("app.spawn"):
+                process = Gio.Subprocess.new(cmd, flags)
+        except GLib.Error as e:
+            lp(f"Failed to launch {cmd}: {e.message}", mode="error")
+            metrics.incr("app.spawn_failed")
+            if callback is not None:
+                callback(False)
+            return None
+        metrics.incr("app.spawned")
+
+        with self.lock:
+            self.children[process] = [cmd, monotonic()]
+        if log_output:
+            stream = Gio.DataInputStream.new(process.get_stdout_pipe())
+            stream.read_line_async(GLib.PRIORITY_LOW, None, self._on_line_read)
+        process.wait_async(None, self._on_exited, callback)
+        return process
+
+    def _on_line_read(self, stream, result) -> None:
+        try:
+            line, _length = stream.read_line_finish(result)
+        except GLib.Error as e:
+            lp(f"Failed to read child output: {e.message}", mode="debug")
+            return
+        if line is None:
+            # End of stream
+            return
+        lp(line.decode("utf-8", errors="replace"), mode="debug")
+        stream.read_line_async(GLib.PRIORITY_LOW, None, self._on_line_read)
+
+    def _on_exited(self, process, result, callback) -> None:
+        with self.lock:
+            cmd, start = self.children.pop(process)
+            latency = monotonic() - start
+            self.exit_latencies.append(latency)
+        successful = False
+        try:
+            process.wait_finish(result)
+        except GLib.Error as e:
+            lp(f"Failed to wait for {cmd}: {e.message}", mode="debug")
+        else:
+            successful = process.get_successful()
+            if process.get_if_exited():
+                status = f"exited with {process.get_exit_status()}"
+            else:
+                status = f"was killed by signal {process.get_term_sig()}"
+            lp(f"{cmd} {status} after {latency:.3f}s", mode="debug")
+        if callback is not None:
+            callback(successful)
+
+    def get_stats(self) -> str:
+        """Describe the supervised children for debug info"""
+        with self.lock:
+            children = list(self.children.values())
+            exit_latencies = list(self.exit_latencies)
+        stats = f"Live child processes: {len(children)}\n"
+        for cmd, start in children:
+            stats += f"  {' '.join(cmd)} (running for {monotonic() - start:.1f}s)\n"
+        if exit_latencies:
+            latencies = ", ".join(f"{latency:.3f}s" for latency in exit_latencies)
+            stats += f"Recent child exit latencies: {latencies}\n"
+        return stats
+
+
+supervisor = ProcessSupervisor()
+
+
+def lrun(cmd: list, wait=True, log_output=True) -> None:
     if wait:
         Command(cmd).run_log_and_wait(logging_handler=logging_handler)
     else:
-        Command(cmd).run_and_log(logging_handler=logging_handler)
+        supervisor.spawn(cmd, log_output=log_output)
 
 
-def create_settings_file(settings) -> None:
-    settings.parents[0].mkdir(parents=True, exist_ok=True)
-    os.chmod(settings.parents[0], 0o755)
-    lrun(
-        [
-            "cp",
-            str(path.join(path.dirname(__file__), "data", "settings", "settings.json")),
-            str(settings),
-        ]
+def get_settings_file() -> Path:
+    """Return the path of the JSON settings file used by older releases."""
+    return Path(
+        os.path.expanduser("~"), ".config", "radxa-welcome", "settings", "settings.json"
     )
-    os.chmod(settings, 0o666)
 
 
-def load_settings() -> JSONConfiguration:
+def get_autostart_file() -> str:
+    """Return the path of the per-user autostart desktop entry."""
+    return os.path.expanduser("~") + "/.config/autostart/com.radxa.welcome.desktop"
+
+
+def migrate_json_settings(settings: Gio.Settings) -> None:
     """
-    Load the settings from the settings file
+    Migrate the settings of older releases to GSettings
 
         Does the following:
-        - Checks if the settings file exists
-        - If not, creates it
-        - If it does, loads the settings from it
+        - Copies the values from the JSON settings file, if there is one
+        - Marks the migration as done so it only happens once
 
-        Returns:  A JSONConfiguration object
+        :param settings:  The settings to migrate into
+        :type settings: Gio.Settings
     """
-    settings = Path(
-        os.path.expanduser("~"), ".config", "radxa-welcome", "settings", "settings.json"
+    if settings.get_boolean("json-migrated"):
+        return
+    settings_file = get_settings_file()
+    try:
+        with open(settings_file, "r") as json_file:
+            data = json.load(json_file)
+        lp(f"Migrating settings from {settings_file}..", mode="info")
+    except FileNotFoundError:
+        data = {}
+    except (OSError, ValueError) as e:
+        lp(f"Could not migrate settings from {settings_file}: {e}", mode="warn")
+        data = {}
+
+    settings.delay()
+    if "autostart" in data:
+        settings.set_boolean("autostart", bool(data["autostart"]))
+    # Older releases wrote the first run flag under a misspelled key
+    first_run = data.get("fist_run", data.get("first_run"))
+    if first_run is not None:
+        settings.set_boolean("first-run", bool(first_run))
+    if "version" in data:
+        settings.set_string("version", str(data["version"]))
+    settings.set_boolean("json-migrated", True)
+    settings.apply()
+
+
+def load_settings() -> Gio.Settings:
+    """
+    Load the settings
+
+        Does the following:
+        - Opens the com.radxa.welcome GSettings schema
+        - Migrates the settings of older releases into it
+
+        Returns:  A Gio.Settings object
+    """
+    settings = Gio.Settings.new("com.radxa.welcome")
+    migrate_json_settings(settings)
+    return settings
+
+
+def get_settings_dump() -> str:
+    """Return every settings key and its value, one per line."""
+    schema = app_settings.props.settings_schema
+    return "".join(
+        f"{key}: {app_settings.get_value(key).print_(False)}\n"
+        for key in schema.list_keys()
     )
-    lp("Settings file: " + str(settings), mode="debug")
-    if not settings.exists():
-        lp("Settings file does not exist. Creating..")
-        create_settings_file(settings)
-    return JSONConfiguration(settings)
 
 
-def settings_get(key: str, default_value: Any) -> Any:
-    try:
-        return app_settings[key]
-    except KeyError as _:
-        app_settings[key] = default_value
-        app_settings.write_data()
-        return default_value
+def settings_get(key: str) -> Any:
+    return app_settings.get_value(key).unpack()
 
 
+@metrics.timed("settings.write")
 def settings_set(key: str, value: Any) -> None:
-    app_settings[key] = value
-    app_settings.write_data()
+    value_type = app_settings.get_value(key).get_type_string()
+    app_settings.set_value(key, GLib.Variant(value_type, value))
 
 
 lp("Logger started.")
@@ -201,38 +356,84 @@ lp("Getting settings..")
 app_settings = load_settings()
 
 lp("Settings loaded.")
-lp(app_settings, mode="debug")
+lp(get_settings_dump(), mode="debug")
 
 
-def change_autolaunch(autolaunch: bool) -> None:
+def update_autostart_entry(autolaunch: bool) -> None:
     """
-    Change the autolaunch setting
+    Add or remove the autostart desktop entry
 
         Does the following:
-        - Changes the autolaunch setting in the settings file
+        - Copies the desktop entry to the autostart directory if autolaunch is set
+        - Removes it from there otherwise
 
-        :param autolaunch:  The new autolaunch setting
+        :param autolaunch:  Whether the app should launch on startup
         :type autolaunch: bool
     """
-    app_settings["autostart"] = autolaunch
-    app_settings.write_data()
-    lp("Autolaunch setting changed to " + str(autolaunch), mode="info")
-    if autolaunch:
-        lrun(
-            [
-                "cp",
-                "/usr/share/applications/com.radxa.welcome.desktop",
-                os.path.expanduser("~") + "/.config/autostart",
-            ]
-        )
-    else:
-        lrun(
-            [
-                "rm",
-                os.path.expanduser("~")
-                + "/.config/autostart/com.radxa.welcome.desktop",
-            ]
-        )
+    autostart_file = get_autostart_file()
+    try:
+        if autolaunch and not os.path.exists(autostart_file):
+            Path(autostart_file).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(
+                "/usr/share/applications/com.radxa.welcome.desktop", autostart_file
+            )
+        elif not autolaunch and os.path.exists(autostart_file):
+            os.remove(autostart_file)
+    except OSError as e:
+        lp(f"Could not update the autostart entry: {e}", mode="error")
+
+
+@metrics.timed("settings.write")
+def on_autostart_changed(settings: Gio.Settings, key: str) -> None:
+    # Widgets are bound to the setting directly, keep the desktop entry in sync
+    update_autostart_entry(settings.get_boolean(key))
+
+
+app_settings.connect("changed::autostart", on_autostart_changed)
+
+
+def is_prefetch_enabled(callback: Callable[[bool], None]) -> None:
+    """
+    Check if the prefetch timer is enabled without blocking the main loop
+
+        :param callback:  Called on the main loop with whether the timer is enabled
+    """
+    supervisor.spawn(
+        ["systemctl", "is-enabled", "--quiet", PREFETCH_TIMER], callback=callback
+    )
+
+
+def change_prefetch(prefetch: bool, callback: Callable[[bool], None]) -> None:
+    """
+    Enable or disable prefetching install candidates
+
+        Does the following:
+        - Enables or disables the system wide prefetch timer through pkexec
+        - Checks the timer again once pkexec has finished, whether the user
+          authorized it or not
+
+        :param prefetch:  Whether to prefetch install candidates
+        :type prefetch: bool
+        :param callback:  Called on the main loop with whether the timer is enabled
+    """
+    lp("Changing prefetch setting to " + str(prefetch), mode="info")
+
+    def on_changed(successful: bool) -> None:
+        if not successful:
+            lp("Could not change the prefetch setting", mode="error")
+        is_prefetch_enabled(callback)
+
+    supervisor.spawn(
+        [
+            "pkexec",
+            "systemctl",
+            "enable" if prefetch else "disable",
+            "--now",
+            PREFETCH_TIMER,
+        ],
+        log_output=True,
+        callback=on_changed,
+    )
 
 
 # Gui support functions
@@ -295,31 +496,8 @@ def add_custom_styling(widget, css_provider) -> None:
 
 # Application support functions
 
-# {app_type: {pretty_name: [pkgname, exec_name]}}
-apps = {
-    "settings": {
-        "Gnome Settings": ["gnome-control-center", "org.gnome.Settings"],
-        "KDE settings": ["systemsettings", "kdesystemsettings"],
-        "XFCE Settings": ["xfce4-settings-manager", "xfce4-settings-manager"],
-        "Cinnamon Settings": ["cinnamon-settings", "cinnamon-settings"],
-    },
-    "terminal": {
-        "Gnome Terminal": ["gnome-terminal", "org.gnome.Terminal"],
-        "Konsole": ["konsole", "org.kde.konsole"],
-        "XFCE4 Terminal": ["xfce4-terminal", "xfce4-terminal"],
-    },
-    "software_center": {
-        "Gnome Software": ["gnome-software", "org.gnome.Software"],
-        "Discover (KDE)": ["plasma-discover", "org.kde.discover"],
-    },
-    "task_manager": {
-        "Gnome System Monitor": ["gnome-system-monitor", "gnome-system-monitor"],
-        "KDE System Monitor": ["plasma-systemmonitor", "org.kde.plasma-systemmonitor"],
-        "XFCE Task Manager": ["xfce4-taskmanager", "xfce4-taskmanager"],
-    },
-}
-
 
+@metrics.timed("dpkg.probe")
 def check_app_installed(app_pkg: str) -> bool:
     """
     Check if an application is installed
@@ -356,6 +534,7 @@ def check_app_installed(app_pkg: str) -> bool:
         return False
 
 
+@metrics.timed("app.install")
 def install_app(app_pkg: str) -> None:
     """
     Install an application
@@ -381,7 +560,7 @@ def launch_app(app_exec: str) -> None:
         :type app_exec: str
     """
     lp(f"Launching {app_exec}..", mode="info")
-    lrun(["gtk-launch", app_exec], wait=False)
+    lrun(["gtk-launch", app_exec], wait=False, log_output=False)
 
 
 def make_install_app_dialog(app_type: str, window) -> Adw.MessageDialog:
@@ -443,14 +622,23 @@ def check_installed(app_type: str, window) -> None:
     if app_type not in apps:
         raise ValueError(f"Unknown app type: {app_type}")
 
+    # Answer from the system wide cache while the dpkg status is unchanged
+    resolved = read_catalog_cache()
+    metrics.incr("catalog.cache_miss" if resolved is None else "catalog.cache_hit")
+
     for pretty_name, (pkgname, exec_name) in apps[app_type].items():
-        if check_app_installed(pkgname):
+        if resolved is not None:
+            installed = pkgname == resolved.get(app_type)
+        else:
+            installed = check_app_installed(pkgname)
+        if installed:
             lp(f"{pretty_name} is installed.", mode="info")
             launch_app(exec_name)
             return
 
-    dialog = make_install_app_dialog(app_type, window)
-    dialog.present()
+    with metrics.timed("dialog.install"):
+        dialog = make_install_app_dialog(app_type, window)
+        dialog.present()
 
 def detect_device() -> str:
     try:
@@ -463,6 +651,25 @@ def detect_device() -> str:
         except FileNotFoundError:
             return "unknown"
         
+def detect_compatible() -> list:
+    """Return the devicetree compatible strings, most specific first."""
+    for compatible_path in (
+        "/proc/device-tree/compatible",
+        "/sys/firmware/devicetree/base/compatible",
+    ):
+        try:
+            with open(compatible_path, "rb") as compatible_file:
+                data = compatible_file.read()
+        except OSError:
+            continue
+        return [
+            entry.decode("ascii", errors="replace")
+            for entry in data.split(b"\x00")
+            if entry
+        ]
+    return []
+
+
 def detect_session_configuration() -> dict:
     # Check for the XDG_SESSION_TYPE environment variable
     try:
@@ -507,10 +714,12 @@ def get_info_for_welcome() -> str:
     fingerprint = get_image_fingerprint()
     extlinux = get_extlinux_conf()
     debug_info = f"Device: {device}\n"
+    debug_info += f"Compatible: {', '.join(detect_compatible())}\n"
     debug_info += f"Desktop Environment: {session['de']}\n"
     debug_info += f"Display Manager: {session['dm']}\n"
     debug_info += f"Wayland: {session['is_wayland']}\n"
     debug_info += f"Image Fingerprint:\n{fingerprint}\n"
+    debug_info += supervisor.get_stats()
     debug_info += f"extlinux.conf:\n{extlinux}"
     return debug_info
 